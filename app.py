@@ -1,24 +1,45 @@
+from __future__ import annotations
+
 import os
+import time
+import random
+import signal
+import hashlib
+import functools
 import aiohttp
+import orjson
+import queue
 import asyncio
 import logging
+import logging.handlers
+from collections import OrderedDict, deque
+from typing import TYPE_CHECKING
+from urllib.parse import quote as url_quote
 from dotenv import load_dotenv
-from telegram import Update, BotCommand, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import (
-    ApplicationBuilder,
-    CommandHandler,
-    MessageHandler,
-    CallbackQueryHandler,
-    filters,
-    ContextTypes,
-)
+from telegram import Message, Update, BotCommand, InlineKeyboardButton, InlineKeyboardMarkup
 from aiohttp import web
 
+# telegram.ext is only needed to build the application in main(); handler
+# annotations are strings (see __future__ import), so import it for typing only
+if TYPE_CHECKING:
+    from telegram.ext import Application, ContextTypes
+
+# uvloop is optional (not available on Windows); fall back to the stock loop
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 # --- Logging setup ---
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO
-)
+# Log calls only enqueue the record; a background thread writes to stderr,
+# so a stalled log pipe can't block the event loop.
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+log_listener = logging.handlers.QueueListener(_log_queue, _log_stream)
+logging.getLogger().addHandler(logging.handlers.QueueHandler(_log_queue))
+logging.getLogger().setLevel(logging.INFO)
+log_listener.start()
 
 # --- Load BOT_TOKEN with type safety ---
 load_dotenv()
@@ -26,154 +47,496 @@ BOT_TOKEN: str = os.getenv("BOT_TOKEN") or ""
 if not BOT_TOKEN:
     raise ValueError("❌ BOT_TOKEN not found in environment variables.")
 
+# --- Webhook settings (used when a public HTTPS URL is available) ---
+# Telegram echoes the secret back in a header, so the token itself never
+# appears in the URL or the access log.
+WEBHOOK_PATH = "/telegram-webhook"
+WEBHOOK_SECRET = hashlib.sha256(BOT_TOKEN.encode()).hexdigest()
+
 # --- Suggested cities for quick weather picker (customize as needed) ---
-SUGGESTED_CITIES = [
-    "Manila", "Quezon City", "Cebu City", "Davao City", "Baguio",
-    "Iloilo City", "Bacolod", "Zamboanga City", "Cagayan de Oro",
-    "Taguig", "Pasig", "Makati", "General Santos", "Tarlac",
-    "Batangas City", "San Fernando", "Olongapo", "Lucena",
-    "Legazpi", "Naga", "Tacloban", "Butuan", "Surigao",
-    "Tagbilaran", "Puerto Princesa", "Roxas City", "Cotabato City",
-    "Dumaguete", "San Pablo", "Dasmariñas", "Santa Rosa", "Lipa",
-    "Tuguegarao", "Iligan", "Pagadian", "Dipolog", "Calbayog"
+# Coordinates are baked in so picker taps go straight to the forecast API;
+# only free-typed /weather <city> lookups need geocoding.
+# name -> (latitude, longitude, country)
+SUGGESTED_CITIES = {
+    "Manila": (14.5995, 120.9842, "Philippines"),
+    "Quezon City": (14.6760, 121.0437, "Philippines"),
+    "Cebu City": (10.3157, 123.8854, "Philippines"),
+    "Davao City": (7.1907, 125.4553, "Philippines"),
+    "Baguio": (16.4023, 120.5960, "Philippines"),
+    "Iloilo City": (10.7202, 122.5621, "Philippines"),
+    "Bacolod": (10.6765, 122.9509, "Philippines"),
+    "Zamboanga City": (6.9214, 122.0790, "Philippines"),
+    "Cagayan de Oro": (8.4542, 124.6319, "Philippines"),
+    "Taguig": (14.5176, 121.0509, "Philippines"),
+    "Pasig": (14.5764, 121.0851, "Philippines"),
+    "Makati": (14.5547, 121.0244, "Philippines"),
+    "General Santos": (6.1164, 125.1716, "Philippines"),
+    "Tarlac": (15.4755, 120.5963, "Philippines"),
+    "Batangas City": (13.7565, 121.0583, "Philippines"),
+    "San Fernando": (15.0286, 120.6898, "Philippines"),
+    "Olongapo": (14.8292, 120.2828, "Philippines"),
+    "Lucena": (13.9373, 121.6170, "Philippines"),
+    "Legazpi": (13.1391, 123.7438, "Philippines"),
+    "Naga": (13.6218, 123.1948, "Philippines"),
+    "Tacloban": (11.2444, 125.0039, "Philippines"),
+    "Butuan": (8.9475, 125.5406, "Philippines"),
+    "Surigao": (9.7843, 125.4888, "Philippines"),
+    "Tagbilaran": (9.6478, 123.8547, "Philippines"),
+    "Puerto Princesa": (9.7392, 118.7353, "Philippines"),
+    "Roxas City": (11.5853, 122.7511, "Philippines"),
+    "Cotabato City": (7.2236, 124.2464, "Philippines"),
+    "Dumaguete": (9.3068, 123.3054, "Philippines"),
+    "San Pablo": (14.0683, 121.3256, "Philippines"),
+    "Dasmariñas": (14.3294, 120.9367, "Philippines"),
+    "Santa Rosa": (14.3122, 121.1114, "Philippines"),
+    "Lipa": (13.9411, 121.1631, "Philippines"),
+    "Tuguegarao": (17.6132, 121.7270, "Philippines"),
+    "Iligan": (8.2280, 124.2452, "Philippines"),
+    "Pagadian": (7.8257, 123.4370, "Philippines"),
+    "Dipolog": (8.5883, 123.3409, "Philippines"),
+    "Calbayog": (12.0672, 124.6042, "Philippines"),
+}
+
+# Picker keyboard is static, so build it once: two cities per row + manual entry
+_picker_cities = list(SUGGESTED_CITIES)
+WEATHER_PICKER_MARKUP = InlineKeyboardMarkup(
+    [
+        [InlineKeyboardButton(city, callback_data=f"city:{city}") for city in _picker_cities[i:i + 2]]
+        for i in range(0, len(_picker_cities), 2)
+    ]
+    + [[InlineKeyboardButton("Enter city manually", callback_data="manual")]]
+)
+
+# --- Bot commands menu ---
+COMMANDS = [
+    BotCommand("start", "Start the bot"),
+    BotCommand("help", "Show help message"),
+    BotCommand("joke", "Get a random joke"),
+    BotCommand("fact", "Get a random fact"),
+    BotCommand("weather", "Check weather for a city"),
+    BotCommand("news", "Get the latest news"),
+    BotCommand("quote", "Get an inspirational quote"),
+    BotCommand("define", "Look up a word definition"),
 ]
 
-# --- Handlers ---
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.message:
-        await update.message.reply_text(
-            "👋 Hello! I'm AiiMBot – your friendly info assistant.\n\n"
-            "Type /help to see what I can do.\n\n"
-            "——\n_Developed by Aii_"
-        , parse_mode="Markdown")
-
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.message:
-        await update.message.reply_text(
-            "🧠 Available Commands:\n"
-            "/start - Start the bot\n"
-            "/help - Show this help message\n"
-            "/joke - Get a random programming joke\n"
-            "/fact - Get a random fact\n"
-            "/weather <city> - Get current weather info\n"
-            "/news - Get the latest news\n"
-            "/quote - Get an inspirational quote\n"
-            "/define <word> - Look up a word definition\n\n"
-            "💬 You can also just chat with me naturally — I'll reply using AI!"
+# --- Static reply texts ---
+WELCOME_TEXT = (
+    "👋 Hello! I'm AiiMBot – your friendly info assistant.\n\n"
+    "Type /help to see what I can do.\n\n"
+    "——\n_Developed by Aii_"
+)
+
+HELP_TEXT = (
+    "🧠 Available Commands:\n"
+    "/start - Start the bot\n"
+    "/help - Show this help message\n"
+    "/joke - Get a random programming joke\n"
+    "/fact - Get a random fact\n"
+    "/weather <city> - Get current weather info\n"
+    "/news - Get the latest news\n"
+    "/quote - Get an inspirational quote\n"
+    "/define <word> - Look up a word definition\n\n"
+    "💬 You can also just chat with me naturally — I'll reply using AI!"
+)
+
+WEATHER_PICKER_TEXT = "🌤️ Pick a city to get current weather, or choose 'Enter city manually' to type a city name."
+WEATHER_MANUAL_TEXT = "✍️ Please type `/weather <city>` (for example: `/weather Manila`)."
+DEFINE_USAGE_TEXT = "📘 Usage: /define <word>"
+UPSTREAM_TIMEOUT_TEXT = "⏱️ Upstream timed out. Please try again in a moment."
+
+# --- Upstream API endpoints (query strings are passed as params=) ---
+JOKE_URL = "https://official-joke-api.appspot.com/random_joke"
+FACT_URL = "https://uselessfacts.jsph.pl/random.json"
+GEO_URL = "https://geocoding-api.open-meteo.com/v1/search"
+WEATHER_URL = "https://api.open-meteo.com/v1/forecast"
+NEWS_URL = "https://newsapi.org/v2/top-headlines"
+NEWS_PAGE_SIZE = 3
+QUOTE_URL = "https://zenquotes.io/api/random"
+DEFINE_URL_TEMPLATE = "https://api.dictionaryapi.dev/api/v2/entries/en/{word}"
+AI_URL = "https://api.mistral.ai/v1/chat/completions"
+
+# --- Shared HTTP session ---
+_session: aiohttp.ClientSession | None = None
+
+async def get_session() -> aiohttp.ClientSession:
+    """Return the shared ClientSession, creating it on first use.
+
+    One pooled session keeps connections (and their TLS state) alive between
+    commands instead of paying a fresh handshake on every outbound call.
+    """
+    global _session
+    if _session is None or _session.closed:
+        # No tcp_nodelay option needed: aiohttp sets TCP_NODELAY on every
+        # connection it opens, so small JSON requests are never Nagle-delayed.
+        connector = aiohttp.TCPConnector(
+            limit=100,
+            limit_per_host=10,
+            use_dns_cache=True,
+            ttl_dns_cache=300,
+            enable_cleanup_closed=True,
+        )
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=10, connect=3, sock_read=7),
+            headers={"Accept-Encoding": "gzip, deflate", "User-Agent": "InfoBot/1.0"},
         )
+    return _session
+
+# Upstream APIs used by the handlers; warmed once at startup
+UPSTREAM_URLS = (
+    "https://official-joke-api.appspot.com",
+    "https://uselessfacts.jsph.pl",
+    "https://geocoding-api.open-meteo.com",
+    "https://api.open-meteo.com",
+    "https://newsapi.org",
+    "https://zenquotes.io",
+    "https://api.dictionaryapi.dev",
+    "https://api.mistral.ai",
+)
 
+async def warm_up_upstreams():
+    """
+    Send a HEAD to each upstream host so its DNS entry lands in the
+    connector cache (and a pooled connection is open) before the first
+    user command needs it. Failures are ignored; handlers retry normally.
+    """
+    session = await get_session()
+
+    async def _head(url: str):
+        async with session.head(url, timeout=aiohttp.ClientTimeout(total=5)):
+            pass
+
+    results = await asyncio.gather(*(_head(url) for url in UPSTREAM_URLS), return_exceptions=True)
+    failed = sum(isinstance(r, Exception) for r in results)
+    logging.info(f"🔥 Warmed {len(UPSTREAM_URLS) - failed}/{len(UPSTREAM_URLS)} upstream hosts")
+
+async def close_session():
+    """Close the shared ClientSession if it was opened."""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+# --- In-memory TTL caches ---
+GEO_CACHE_TTL = float("inf")  # city coordinates don't move; the LRU cap bounds memory
+WEATHER_CACHE_TTL = 10 * 60  # Open-Meteo refreshes current conditions every ~15 min
+NEWS_CACHE_TTL = 5 * 60  # headlines are the same for every caller within a news cycle
+CACHE_MAX_ENTRIES = 1024
+RESPONSE_CACHE_MAX_ENTRIES = 512
+
+# key -> (expires_at, value), kept in LRU order
+_geo_cache: OrderedDict = OrderedDict()
+_weather_cache: OrderedDict = OrderedDict()
+_response_cache: OrderedDict = OrderedDict()
+
+def _cache_get(cache: OrderedDict, key):
+    """Return the cached value for `key`, or None if missing or expired."""
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    expires_at, value = entry
+    if expires_at <= time.monotonic():
+        del cache[key]
+        return None
+    cache.move_to_end(key)
+    return value
+
+def _cache_set(cache: OrderedDict, key, value, ttl: float, max_entries: int = CACHE_MAX_ENTRIES):
+    """Store `value` under `key` for `ttl` seconds, evicting the oldest entries."""
+    cache[key] = (time.monotonic() + ttl, value)
+    cache.move_to_end(key)
+    while len(cache) > max_entries:
+        cache.popitem(last=False)
+
+# --- Request coalescing ---
+# key -> task currently fetching it
+_inflight: dict = {}
+
+async def _single_flight(key, fetch):
+    """
+    Run `fetch()` for `key` unless the same key is already being fetched, in
+    which case wait for that result instead. Errors reach every waiter.
+    """
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(fetch())
+        _inflight[key] = task
+
+        def _done(t):
+            if _inflight.get(key) is t:
+                del _inflight[key]
+            if not t.cancelled():
+                t.exception()  # mark retrieved in case every caller gave up
+
+        task.add_done_callback(_done)
+    # The fetch is its own task and every caller (the first included) waits
+    # through a shield, so one caller being cancelled can't cancel it for
+    # the rest
+    return await asyncio.shield(task)
+
+# --- JSON GET with retries ---
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504, 529})
+MAX_RETRY_AFTER = 30  # seconds; never honour a longer Retry-After
+CALL_BUDGET = 15  # seconds; default worst case for one _get_json call
+MIN_ATTEMPT_TIME = 1  # seconds; don't retry with less time than this left
+
+def _retry_delay(attempt: int, retry_after: str | None = None) -> float:
+    """Seconds to wait before retry number `attempt + 1`."""
+    if retry_after and retry_after.isdigit():
+        return min(int(retry_after), MAX_RETRY_AFTER)
+    # Linear backoff with jitter so concurrent callers don't retry in lockstep
+    return random.uniform(2, 4) * (attempt + 1)
+
+async def _get_json(url: str, *, params: dict | None = None, retries: int = 3, timeout=None,
+                    budget: float = CALL_BUDGET):
+    """
+    GET `url` on the shared session and return the decoded JSON body, or
+    None if the upstream didn't answer 200. 429/5xx replies, timeouts and
+    connection errors are retried up to `retries` attempts in total, all
+    within `budget` seconds: each retry's timeout is clamped to the time
+    left after its backoff, and no retry starts with less than
+    MIN_ATTEMPT_TIME left. The last timeout or connection error is
+    re-raised to the caller.
+    """
+    session = await get_session()
+    base_timeout = timeout or session.timeout
+    attempt_timeout = base_timeout.total or budget
+    started = time.monotonic()
+
+    for attempt in range(retries):
+        # Same connect/read limits, but the whole attempt must fit the budget
+        attempt_total = aiohttp.ClientTimeout(
+            total=min(attempt_timeout, budget - (time.monotonic() - started)),
+            connect=base_timeout.connect,
+            sock_connect=base_timeout.sock_connect,
+            sock_read=base_timeout.sock_read,
+        )
+        error = None
+        try:
+            async with session.get(url, params=params, timeout=attempt_total) as resp:
+                if resp.status == 200:
+                    return await resp.json(loads=orjson.loads)
+                if resp.status not in RETRY_STATUSES:
+                    return None
+                delay = _retry_delay(attempt, resp.headers.get("Retry-After"))
+                reason = f"HTTP {resp.status}"
+        except (asyncio.TimeoutError, aiohttp.ClientConnectionError) as e:
+            error = e
+            delay = _retry_delay(attempt)
+            reason = type(e).__name__
+        time_left = budget - (time.monotonic() - started) - delay
+        if attempt == retries - 1 or time_left < MIN_ATTEMPT_TIME:
+            if error is not None:
+                raise error
+            return None
+        logging.warning(f"GET {url} failed ({reason}); retrying in {delay:.1f}s")
+        await asyncio.sleep(delay)
+    return None
+
+async def cached_get_json(url: str, ttl: float, params: dict | None = None, **kwargs):
+    """
+    Like _get_json, but successful bodies are cached by URL + params for
+    `ttl` seconds; a `ttl` of 0 always goes to the network.
+    """
+    key = (url, tuple(sorted(params.items())) if params else ())
+    if ttl > 0:
+        data = _cache_get(_response_cache, key)
+        if data is not None:
+            return data
 
-async def joke_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not update.message:
+    data = await _get_json(url, params=params, **kwargs)
+    if data is None:
+        return None
+
+    if ttl > 0:
+        _cache_set(_response_cache, key, data, ttl, RESPONSE_CACHE_MAX_ENTRIES)
+    return data
+
+# --- Handlers ---
+def requires_message(fn):
+    """Skip updates without a message and pass the message to the handler"""
+    @functools.wraps(fn)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        message = update.message
+        if message is None:
+            return
+        return await fn(update, context, message)
+    return wrapper
+
+@requires_message
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE, message: Message):
+    await message.reply_text(WELCOME_TEXT, parse_mode="Markdown")
+
+@requires_message
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE, message: Message):
+    await message.reply_text(HELP_TEXT)
+
+
+@requires_message
+async def joke_command(update: Update, context: ContextTypes.DEFAULT_TYPE, message: Message):
+    try:
+        data = await _get_json(JOKE_URL)
+    except asyncio.TimeoutError:
+        await message.reply_text(UPSTREAM_TIMEOUT_TEXT)
+        return
+    except aiohttp.ClientError:
+        data = None
+    if data is None:
+        await message.reply_text("❌ Couldn't fetch a joke right now.")
+        return
+    joke = f"😂 {data['setup']}\n\n👉 {data['punchline']}"
+    await message.reply_text(joke)
+
+@requires_message
+async def fact_command(update: Update, context: ContextTypes.DEFAULT_TYPE, message: Message):
+    try:
+        data = await _get_json(FACT_URL, params={"language": "en"})
+    except asyncio.TimeoutError:
+        await message.reply_text(UPSTREAM_TIMEOUT_TEXT)
         return
-    url = "https://official-joke-api.appspot.com/random_joke"
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as response:
-            if response.status == 200:
-                data = await response.json()
-                joke = f"😂 {data['setup']}\n\n👉 {data['punchline']}"
-                await update.message.reply_text(joke)
-            else:
-                await update.message.reply_text("❌ Couldn't fetch a joke right now.")
-
-async def fact_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not update.message:
+    except aiohttp.ClientError:
+        data = None
+    if data is None:
+        await message.reply_text("❌ Couldn't fetch a fact right now.")
         return
-    url = "https://uselessfacts.jsph.pl/random.json?language=en"
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as response:
-            if response.status == 200:
-                data = await response.json()
-                fact = f"💡 {data['text']}"
-                await update.message.reply_text(fact)
-            else:
-                await update.message.reply_text("❌ Couldn't fetch a fact right now.")
+    fact = f"💡 {data['text']}"
+    await message.reply_text(fact)
 
 # --- Reusable weather fetch helper ---
-async def fetch_weather_for_city(city: str) -> str:
+# Geocoding and forecast run back to back, so each hop gets its own timeout
+# and a retry budget that keeps a whole /weather lookup under ~24s
+WEATHER_HOP_TIMEOUT = aiohttp.ClientTimeout(total=5, connect=3)
+WEATHER_HOP_BUDGET = 12
+
+class WeatherLookupError(Exception):
+    """A weather lookup step failed; the message is safe to show to the user."""
+
+async def _geocode(city: str) -> tuple:
     """
-    Returns a formatted string of current weather for `city`.
-    If it can't find the city, returns a friendly error string.
+    Resolve `city` to (lat, lon, name, country), using the geocoding cache.
+    Concurrent misses for the same city share one request.
+    Raises WeatherLookupError with a friendly message on failure.
     """
-    city = city.strip()
-    if not city:
-        return "❌ No city provided."
-
-    # Geocoding: get lat/lon
-    geo_url = f"https://geocoding-api.open-meteo.com/v1/search?name={city}"
+    geo_key = city.lower()
+    location = _cache_get(_geo_cache, geo_key)
+    if location is not None:
+        return location
+    return await _single_flight(("geo", geo_key), lambda: _fetch_location(city))
+
+async def _fetch_location(city: str) -> tuple:
+    """Geocoding request behind _geocode; caches and returns the location."""
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(geo_url, timeout=aiohttp.ClientTimeout(total=10)) as geo_response:
-                if geo_response.status != 200:
-                    return "❌ Couldn't find that city (geocoding failed)."
-                geo_data = await geo_response.json()
+        # Only the first match is used, so ask for just one
+        geo_data = await _get_json(
+            GEO_URL, params={"name": city, "count": 1},
+            timeout=WEATHER_HOP_TIMEOUT, budget=WEATHER_HOP_BUDGET,
+        )
+    except asyncio.TimeoutError:
+        raise WeatherLookupError(UPSTREAM_TIMEOUT_TEXT)
     except Exception:
-        return "❌ Couldn't reach geocoding service."
+        raise WeatherLookupError("❌ Couldn't reach geocoding service.")
+    if geo_data is None:
+        raise WeatherLookupError("❌ Couldn't find that city (geocoding failed).")
 
     if not geo_data or "results" not in geo_data or len(geo_data["results"]) == 0:
-        return "❌ Couldn't find that city."
+        raise WeatherLookupError("❌ Couldn't find that city.")
 
     # Use first result
     loc = geo_data["results"][0]
-    lat = loc.get("latitude")
-    lon = loc.get("longitude")
-    name = loc.get("name") or city
-    country = loc.get("country") or ""
-
-    weather_url = (
-        f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}"
-        f"&current_weather=true"
+    if loc.get("latitude") is None or loc.get("longitude") is None:
+        raise WeatherLookupError("❌ Couldn't find that city.")
+    location = (
+        loc["latitude"],
+        loc["longitude"],
+        loc.get("name") or city,
+        loc.get("country") or "",
     )
+    _cache_set(_geo_cache, city.lower(), location, GEO_CACHE_TTL)
+    return location
 
+async def _current_weather(lat: float, lon: float) -> tuple:
+    """
+    Return (temperature, windspeed, winddirection) for (lat, lon). Nearby
+    lookups within WEATHER_CACHE_TTL share one upstream call, and so do
+    concurrent misses for the same spot.
+    Raises WeatherLookupError with a friendly message on failure.
+    """
+    weather_key = (round(lat, 2), round(lon, 2))
+    current = _cache_get(_weather_cache, weather_key)
+    if current is not None:
+        return current
+    return await _single_flight(("weather", weather_key), lambda: _fetch_current_weather(lat, lon))
+
+async def _fetch_current_weather(lat: float, lon: float) -> tuple:
+    """Forecast request behind _current_weather; caches and returns the reading."""
+    weather_params = {"latitude": lat, "longitude": lon, "current_weather": "true"}
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(weather_url, timeout=aiohttp.ClientTimeout(total=10)) as weather_response:
-                if weather_response.status != 200:
-                    return "❌ Couldn't fetch weather right now."
-                weather_data = await weather_response.json()
+        weather_data = await _get_json(
+            WEATHER_URL, params=weather_params,
+            timeout=WEATHER_HOP_TIMEOUT, budget=WEATHER_HOP_BUDGET,
+        )
+    except asyncio.TimeoutError:
+        raise WeatherLookupError(UPSTREAM_TIMEOUT_TEXT)
     except Exception:
-        return "❌ Couldn't reach weather service."
-
-    current = weather_data.get("current_weather")
-    if not current:
-        return "❌ Weather data missing."
+        raise WeatherLookupError("❌ Couldn't reach weather service.")
+    if weather_data is None:
+        raise WeatherLookupError("❌ Couldn't fetch weather right now.")
 
-    temp = current.get("temperature")
-    wind = current.get("windspeed")
-    wind_dir = current.get("winddirection")
+    # Open-Meteo always sends these fields with current_weather=true
+    try:
+        block = weather_data["current_weather"]
+        current = (block["temperature"], block["windspeed"], block["winddirection"])
+    except (KeyError, TypeError):
+        raise WeatherLookupError("❌ Weather data missing.")
+    _cache_set(_weather_cache, (round(lat, 2), round(lon, 2)), current, WEATHER_CACHE_TTL)
+    return current
+
+def _format_weather(name: str, country: str, current: tuple) -> str:
+    temp, wind, wind_dir = current
     return f"🌤️ Weather in {name}, {country}:\n🌡️ {temp}°C\n💨 Wind: {wind} km/h (dir {wind_dir}°)"
 
+async def fetch_weather_for_suggested_city(city: str) -> str:
+    """Weather for a picker city; its coordinates are known, so no geocoding."""
+    lat, lon, country = SUGGESTED_CITIES[city]
+    try:
+        current = await _current_weather(lat, lon)
+    except WeatherLookupError as e:
+        return str(e)
+    return _format_weather(city, country, current)
+
+async def fetch_weather_for_city(city: str) -> str:
+    """
+    Returns a formatted string of current weather for `city`.
+    If it can't find the city, returns a friendly error string.
+    Geocoding and current-weather results are cached (see GEO_CACHE_TTL
+    and WEATHER_CACHE_TTL) so repeated lookups skip the upstream calls.
+    """
+    city = city.strip()
+    if not city:
+        return "❌ No city provided."
+
+    # Both steps are cache-first: a known city with fresh weather makes no requests
+    try:
+        lat, lon, name, country = await _geocode(city)
+        current = await _current_weather(lat, lon)
+    except WeatherLookupError as e:
+        return str(e)
+
+    return _format_weather(name, country, current)
+
 # --- Weather command (shows picker if no args) ---
-async def weather_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@requires_message
+async def weather_command(update: Update, context: ContextTypes.DEFAULT_TYPE, message: Message):
     """Fetch current weather using Open-Meteo API. If no args show a quick city picker."""
-    if not update.message:
-        return
-
     # If user provided a city: use helper
     if context.args:
         city = " ".join(context.args)
         result = await fetch_weather_for_city(city)
-        await update.message.reply_text(result)
+        await message.reply_text(result)
         return
 
     # No args: show inline keyboard of suggested cities + 'Enter Manually' button
-    keyboard = []
-    row = []
-    for i, city in enumerate(SUGGESTED_CITIES):
-        row.append(InlineKeyboardButton(city, callback_data=f"city:{city}"))
-        if len(row) == 2:
-            keyboard.append(row)
-            row = []
-    if row:
-        keyboard.append(row)
-
-    keyboard.append([InlineKeyboardButton("Enter city manually", callback_data="manual")])
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(
-        "🌤️ Pick a city to get current weather, or choose 'Enter city manually' to type a city name.",
-        reply_markup=reply_markup
-    )
+    await message.reply_text(WEATHER_PICKER_TEXT, reply_markup=WEATHER_PICKER_MARKUP)
 
 # --- Callback handler for weather buttons ---
 async def weather_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -186,91 +549,168 @@ async def weather_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if data.startswith("city:"):
         city = data.split("city:", 1)[1]
         await query.edit_message_text(f"🔎 Fetching weather for {city}...")
-        result = await fetch_weather_for_city(city)
+        if city in SUGGESTED_CITIES:
+            result = await fetch_weather_for_suggested_city(city)
+        else:
+            # Buttons from an older picker may name a city no longer listed
+            result = await fetch_weather_for_city(city)
         await query.edit_message_text(result)
     elif data == "manual":
         # instruct the user to use /weather <city>
-        await query.edit_message_text("✍️ Please type `/weather <city>` (for example: `/weather Manila`).")
+        await query.edit_message_text(WEATHER_MANUAL_TEXT)
     else:
         await query.edit_message_text("❌ Unknown action.")
 
 # --- 4️⃣ News Command ---
-async def news_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@requires_message
+async def news_command(update: Update, context: ContextTypes.DEFAULT_TYPE, message: Message):
     """Fetch top news headlines from NewsAPI"""
-    if not update.message:
-        return
-
     api_key = os.getenv("NEWS_API_KEY")
     if not api_key:
-        await update.message.reply_text("⚠️ NEWS_API_KEY not set in environment.")
+        await message.reply_text("⚠️ NEWS_API_KEY not set in environment.")
         return
 
-    url = f"https://newsapi.org/v2/top-headlines?country=us&pageSize=3&apiKey={api_key}"
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as resp:
-            if resp.status == 200:
-                data = await resp.json()
-                articles = data.get("articles", [])
-                if not articles:
-                    await update.message.reply_text("😶 No news found.")
-                    return
-                headlines = "\n\n".join(
-                    [f"🗞️ {a['title']}\n🔗 {a.get('url','')}" for a in articles[:3]]
-                )
-                await update.message.reply_text(f"📰 Top Headlines:\n\n{headlines}")
-            else:
-                await update.message.reply_text("❌ Couldn't fetch news right now.")
+    # apiKey travels as a query param, never inside a logged URL string
+    params = {"country": "us", "pageSize": NEWS_PAGE_SIZE, "apiKey": api_key}
+    try:
+        data = await cached_get_json(NEWS_URL, NEWS_CACHE_TTL, params=params)
+    except asyncio.TimeoutError:
+        await message.reply_text(UPSTREAM_TIMEOUT_TEXT)
+        return
+    except aiohttp.ClientError:
+        data = None
+    if data is None:
+        await message.reply_text("❌ Couldn't fetch news right now.")
+        return
+
+    articles = data.get("articles", [])
+    if not articles:
+        await message.reply_text("😶 No news found.")
+        return
+    headlines = "\n\n".join(
+        f"🗞️ {a['title']}\n🔗 {a.get('url','')}" for a in articles[:NEWS_PAGE_SIZE]
+    )
+    await message.reply_text(f"📰 Top Headlines:\n\n{headlines}")
 
 # --- 5️⃣ Quote Command ---
-async def quote_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@requires_message
+async def quote_command(update: Update, context: ContextTypes.DEFAULT_TYPE, message: Message):
     """Fetch a random motivational quote"""
-    if not update.message:
+    try:
+        data = await _get_json(QUOTE_URL)
+    except asyncio.TimeoutError:
+        await message.reply_text(UPSTREAM_TIMEOUT_TEXT)
         return
-
-    url = "https://zenquotes.io/api/random"
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
-            if response.status == 200:
-                data = await response.json()
-                # API returns a list with a single dict
-                quote = data[0].get("q", "")
-                author = data[0].get("a", "")
-                await update.message.reply_text(f"💬 \"{quote}\"\n— {author}")
-            else:
-                await update.message.reply_text("❌ Couldn't fetch a quote right now.")
+    except aiohttp.ClientError:
+        data = None
+    if data is None:
+        await message.reply_text("❌ Couldn't fetch a quote right now.")
+        return
+    # API returns a list with a single dict
+    quote = data[0].get("q", "")
+    author = data[0].get("a", "")
+    await message.reply_text(f"💬 \"{quote}\"\n— {author}")
 
 # --- 6️⃣ Define Command ---
-async def define_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@requires_message
+async def define_command(update: Update, context: ContextTypes.DEFAULT_TYPE, message: Message):
     """Fetch a word definition"""
-    if not update.message:
-        return
-
     if not context.args:
-        await update.message.reply_text("📘 Usage: /define <word>")
+        await message.reply_text(DEFINE_USAGE_TEXT)
         return
 
     word = context.args[0]
-    url = f"https://api.dictionaryapi.dev/api/v2/entries/en/{word}"
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as resp:
-            if resp.status == 200:
-                data = await resp.json()
-                try:
-                    meaning = data[0]["meanings"][0]["definitions"][0]["definition"]
-                    await update.message.reply_text(f"📖 Definition of {word}:\n{meaning}")
-                except Exception:
-                    await update.message.reply_text("❌ Couldn't parse definition result.")
-            else:
-                await update.message.reply_text("❌ Word not found.")
+    # Path segment, so escape "/" too (e.g. "and/or", "café")
+    url = DEFINE_URL_TEMPLATE.format(word=url_quote(word, safe=""))
+    try:
+        data = await _get_json(url)
+    except asyncio.TimeoutError:
+        await message.reply_text(UPSTREAM_TIMEOUT_TEXT)
+        return
+    except aiohttp.ClientError:
+        data = None
+    if data is None:
+        await message.reply_text("❌ Word not found.")
+        return
+    try:
+        meaning = data[0]["meanings"][0]["definitions"][0]["definition"]
+    except Exception:
+        await message.reply_text("❌ Couldn't parse definition result.")
+        return
+    await message.reply_text(f"📖 Definition of {word}:\n{meaning}")
 
 # --- AI Chat Handler (Mistral Integration) ---
+class AIMDLimiter:
+    """
+    Adaptive cap on concurrent AI requests (AIMD, as in TCP congestion
+    control): the limit grows by `alpha` after each fast success and is
+    multiplied by `beta` after a 429/5xx, a timeout, or when the recent
+    average latency exceeds `target_latency`. A Retry-After from the
+    provider pauses new requests for that long, and so does a response
+    reporting less than `quota_floor` of the request quota left.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=16, target_latency=5.0,
+                 alpha=0.5, beta=0.5, window=20, quota_floor=0.1):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.alpha = alpha
+        self.beta = beta
+        self.quota_floor = quota_floor
+        self._latencies = deque(maxlen=window)
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._cond = asyncio.Condition()
+
+    async def __aenter__(self):
+        while True:
+            # Sleep out a pause without holding a slot, so a request
+            # cancelled while paused doesn't leak it
+            delay = self._paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            async with self._cond:
+                await self._cond.wait_for(lambda: self._in_flight < int(self.limit))
+                # A pause may have started while we queued for the slot
+                if self._paused_until <= time.monotonic():
+                    self._in_flight += 1
+                    return self
+
+    async def __aexit__(self, *exc_info):
+        async with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def record(self, ok: bool, latency: float):
+        """Feed back one request's outcome and adjust the limit."""
+        self._latencies.append(latency)
+        avg_latency = sum(self._latencies) / len(self._latencies)
+        if ok and avg_latency <= self.target_latency:
+            self.limit = min(self.maximum, self.limit + self.alpha)
+        else:
+            self.limit = max(self.minimum, self.limit * self.beta)
+
+    def pause(self, seconds: float):
+        """Hold back new requests for `seconds` (e.g. from Retry-After)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def check_quota(self, headers):
+        """Pause before the provider starts rejecting us if its quota is nearly spent."""
+        remaining = headers.get("x-ratelimit-remaining-requests", "")
+        limit = headers.get("x-ratelimit-limit-requests", "")
+        if remaining.isdigit() and limit.isdigit() and int(remaining) < int(limit) * self.quota_floor:
+            self.pause(_retry_delay(0, headers.get("Retry-After")))
+
+_ai_limiter = AIMDLimiter()
+
 async def generate_ai_reply(message: str) -> str:
     """Send user message to Mistral AI and return the reply"""
     api_key = os.getenv("AI_API_KEY")
     if not api_key:
         return "⚠️ AI service is not configured yet."
 
-    url = "https://api.mistral.ai/v1/chat/completions"
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json"
@@ -285,30 +725,40 @@ async def generate_ai_reply(message: str) -> str:
     }
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                url,
-                headers=headers,
-                json=payload,
-                timeout=aiohttp.ClientTimeout(total=15)
-            ) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    content = data["choices"][0]["message"].get("content") or ""
-                    return content.strip()
-                else:
+        session = await get_session()
+        async with _ai_limiter:
+            started = time.monotonic()
+            try:
+                async with session.post(
+                    AI_URL,
+                    headers=headers,
+                    json=payload,
+                    timeout=aiohttp.ClientTimeout(total=15)
+                ) as resp:
+                    latency = time.monotonic() - started
+                    _ai_limiter.check_quota(resp.headers)
+                    if resp.status == 200:
+                        _ai_limiter.record(True, latency)
+                        data = await resp.json(loads=orjson.loads)
+                        content = data["choices"][0]["message"].get("content") or ""
+                        return content.strip()
+                    if resp.status in RETRY_STATUSES:
+                        # Provider is overloaded or rate limiting us: back off
+                        _ai_limiter.record(False, latency)
+                        _ai_limiter.pause(_retry_delay(0, resp.headers.get("Retry-After")))
                     logging.error(f"AI API Error {resp.status}: {await resp.text()}")
                     return "⚠️ I'm having trouble thinking right now. Try again later!"
+            except asyncio.TimeoutError:
+                _ai_limiter.record(False, time.monotonic() - started)
+                raise
     except Exception as e:
         logging.warning(f"AI request failed: {e}")
         return "❌ I couldn't connect to my brain. Please try again later."
 
-async def echo_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@requires_message
+async def echo_message(update: Update, context: ContextTypes.DEFAULT_TYPE, message: Message):
     """Reply with AI if message isn't a command"""
-    if not update.message:
-        return
-
-    user_text = (update.message.text or "").strip()
+    user_text = (message.text or "").strip()
 
     # Skip if message looks like a bot command
     if user_text.startswith("/"):
@@ -316,108 +766,206 @@ async def echo_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Use AI for all non-command messages
     ai_reply = await generate_ai_reply(user_text)
-    await update.message.reply_text(ai_reply)
+    await message.reply_text(ai_reply)
+
+# --- Health check + webhook server ---
+TELEGRAM_APP_KEY: web.AppKey[Application] = web.AppKey("telegram_app")
+
+# Set once the web server is accepting connections
+WEB_READY = asyncio.Event()
+# Set on SIGTERM/SIGINT (or when main() exits) to stop long-running tasks
+SHUTDOWN = asyncio.Event()
 
-# --- Health check server ---
 async def handle_health(request):
     return web.Response(text="ok")
 
-async def start_web_server():
-    """Start the health check web server"""
+async def handle_telegram_webhook(request: web.Request) -> web.Response:
+    """Push an update posted by Telegram onto the bot's update queue"""
+    if request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+        return web.Response(status=403, text="forbidden")
+    application = request.app[TELEGRAM_APP_KEY]
+    try:
+        data = await request.json(loads=orjson.loads)
+    except ValueError:
+        return web.Response(status=400, text="invalid update")
+    await application.update_queue.put(Update.de_json(data, application.bot))
+    return web.Response(text="ok")
+
+async def start_web_server(application: Application):
+    """Start the web server serving /health and the Telegram webhook"""
     app = web.Application()
+    app[TELEGRAM_APP_KEY] = application
     app.router.add_get("/health", handle_health)
+    app.router.add_post(WEBHOOK_PATH, handle_telegram_webhook)
     runner = web.AppRunner(app)
     await runner.setup()
-    port = int(os.environ.get("PORT", 10000))
-    site = web.TCPSite(runner, "0.0.0.0", port)
-    await site.start()
-    logging.info(f"🌐 Health check server running on port {port}")
-    # Keep the server running
-    await asyncio.Event().wait()
+    try:
+        port = int(os.environ.get("PORT", 10000))
+        # Accepted connections get TCP_NODELAY from aiohttp's server protocol
+        site = web.TCPSite(runner, "0.0.0.0", port)
+        await site.start()
+        logging.info(f"🌐 Web server (health + webhook) running on port {port}")
+        WEB_READY.set()
+        # Keep the server running until shutdown is requested
+        await SHUTDOWN.wait()
+    finally:
+        await runner.cleanup()
 
 # --- Self-ping background task ---
 async def self_ping_task():
     """Ping own health endpoint every 10 minutes to keep service alive"""
-    await asyncio.sleep(30)  # Initial delay
-    url = f"{os.getenv('RENDER_EXTERNAL_URL', '')}/health"
-    if not url or "http" not in url:
+    # RENDER_EXTERNAL_URL already includes the scheme
+    base_url = os.getenv("RENDER_EXTERNAL_URL", "").rstrip("/")
+    if not base_url.startswith("http"):
         logging.warning("⚠️ No RENDER_EXTERNAL_URL found; skipping self-ping.")
         return
+    url = f"{base_url}/health"
+
+    # Start pinging as soon as the health endpoint is actually up
+    await WEB_READY.wait()
 
-    while True:
+    while not SHUTDOWN.is_set():
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as resp:
-                    logging.info(f"🔄 Self-ping -> {url} [{resp.status}]")
+            session = await get_session()
+            # HEAD is enough to keep the service warm; /health answers it too
+            async with session.head(url, timeout=aiohttp.ClientTimeout(total=5)) as resp:
+                logging.info(f"🔄 Self-ping -> {url} [{resp.status}]")
         except Exception as e:
             logging.warning(f"Self-ping failed: {e}")
-        await asyncio.sleep(600)  # 10 minutes
+        # ~10 minutes, jittered so multiple replicas don't ping in lockstep;
+        # waiting on SHUTDOWN instead of sleeping lets shutdown end this at once
+        try:
+            await asyncio.wait_for(SHUTDOWN.wait(), timeout=600 + random.randint(-30, 30))
+        except asyncio.TimeoutError:
+            pass
+
+# --- Command routing ---
+# All commands share one CommandHandler; the command name picks the callback
+COMMAND_HANDLERS = {
+    "start": start,
+    "help": help_command,
+    "joke": joke_command,
+    "fact": fact_command,
+    "weather": weather_command,
+    "news": news_command,
+    "quote": quote_command,
+    "define": define_command,
+}
+
+async def route_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Dispatch a /command to its handler with a single dict lookup"""
+    if not update.message or not update.message.text:
+        return
+    # "/weather@AiiMBot Manila" -> "weather"
+    command = update.message.text.split(maxsplit=1)[0][1:].split("@", 1)[0].lower()
+    handler = COMMAND_HANDLERS.get(command)
+    if handler:
+        await handler(update, context)
 
 # --- Main async function ---
+async def publish_commands(bot):
+    """Set the bot's command menu; off the critical path, so failures only log"""
+    try:
+        await bot.set_my_commands(COMMANDS)
+    except Exception as e:
+        logging.warning(f"Couldn't set bot commands menu: {e}")
+
+async def register_webhook(bot, url: str):
+    """Point Telegram at our webhook route once the web server is listening"""
+    await WEB_READY.wait()
+    await bot.set_webhook(url, secret_token=WEBHOOK_SECRET)
+    logging.info(f"📬 Receiving updates via webhook on {url}")
+
+def _request_shutdown(sig: signal.Signals):
+    """Signal handler: ask every long-running task to wind down"""
+    logging.info(f"🛑 Received {sig.name}, shutting down...")
+    SHUTDOWN.set()
+
 async def main():
     """Main function that runs everything concurrently"""
+    from telegram.ext import (
+        AIORateLimiter,
+        ApplicationBuilder,
+        CommandHandler,
+        MessageHandler,
+        CallbackQueryHandler,
+        filters,
+    )
+
     # Build the bot application - BOT_TOKEN is guaranteed to be str here
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
-
-    # Add handlers
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("help", help_command))
-    app.add_handler(CommandHandler("joke", joke_command))
-    app.add_handler(CommandHandler("fact", fact_command))
-    app.add_handler(CommandHandler("weather", weather_command))
-    app.add_handler(CommandHandler("news", news_command))
-    app.add_handler(CommandHandler("quote", quote_command))
-    app.add_handler(CommandHandler("define", define_command))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, echo_message))
+    # AIORateLimiter keeps sends inside Telegram's flood limits (~30 msg/s
+    # overall, 20 msg/min per group) and retries a 429 after its retry_after
+    rate_limiter = AIORateLimiter(overall_max_rate=30, max_retries=3)
+    app = ApplicationBuilder().token(BOT_TOKEN).rate_limiter(rate_limiter).build()
+
+    # Add handlers - block=False so one slow upstream request doesn't hold up
+    # updates from other chats
+    app.add_handler(CommandHandler(list(COMMAND_HANDLERS), route_command, block=False))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, echo_message, block=False))
     # CallbackQueryHandler for weather picker
-    app.add_handler(CallbackQueryHandler(weather_callback, pattern="^(city:|manual)"))
-
-    # Set bot commands menu
-    await app.bot.set_my_commands([
-        BotCommand("start", "Start the bot"),
-        BotCommand("help", "Show help message"),
-        BotCommand("joke", "Get a random joke"),
-        BotCommand("fact", "Get a random fact"),
-        BotCommand("weather", "Check weather for a city"),
-        BotCommand("news", "Get the latest news"),
-        BotCommand("quote", "Get an inspirational quote"),
-        BotCommand("define", "Look up a word definition"),
-    ])
+    app.add_handler(CallbackQueryHandler(weather_callback, pattern="^(city:|manual)", block=False))
 
     logging.info("🤖 InfoBot is starting...")
 
+    # Webhooks need a public HTTPS URL; without one fall back to long polling
+    public_url = (os.getenv("RENDER_EXTERNAL_URL") or "").rstrip("/")
+    use_webhook = public_url.startswith("https://")
+
+    # Render sends SIGTERM on redeploy; turn it (and Ctrl+C) into a clean shutdown
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, _request_shutdown, sig)
+        except NotImplementedError:
+            pass  # e.g. Windows; KeyboardInterrupt still works there
+
     # Initialize the application
     await app.initialize()
+    await get_session()
     await app.start()
 
-    # Type safety check for updater
-    if not app.updater:
-        raise RuntimeError("❌ Failed to initialize bot updater")
-
-    # Create tasks for concurrent execution
-    tasks = [
-        asyncio.create_task(start_web_server(), name="web_server"),
-        asyncio.create_task(self_ping_task(), name="self_ping"),
-        asyncio.create_task(app.updater.start_polling(), name="bot_polling"),
-    ]
-
-    logging.info("✅ All services started successfully!")
-
-    # Wait for all tasks
     try:
-        await asyncio.gather(*tasks)
+        if not use_webhook:
+            if not app.updater:
+                # Type safety check for updater
+                raise RuntimeError("❌ Failed to initialize bot updater")
+            logging.info("📡 No public HTTPS URL; receiving updates via polling")
+
+        # Run services concurrently; if one fails the others are cancelled
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(start_web_server(app), name="web_server")
+            if use_webhook:
+                # Telegram pushes updates to the web server's webhook route
+                tg.create_task(
+                    register_webhook(app.bot, f"{public_url}{WEBHOOK_PATH}"), name="set_webhook"
+                )
+            tg.create_task(publish_commands(app.bot), name="set_commands")
+            tg.create_task(self_ping_task(), name="self_ping")
+            tg.create_task(warm_up_upstreams(), name="warm_up")
+            if not use_webhook and app.updater:
+                tg.create_task(app.updater.start_polling(), name="bot_polling")
+            logging.info("✅ All services started successfully!")
     except KeyboardInterrupt:
         logging.info("🛑 Shutting down...")
     finally:
-        # Cleanup - safe to access updater now since we checked it exists
-        if app.updater:
+        # Stop the web server and self-ping, then the bot itself
+        SHUTDOWN.set()
+        # Cleanup - the updater only runs in polling mode
+        if app.updater and app.updater.running:
             await app.updater.stop()
         await app.stop()
         await app.shutdown()
+        await close_session()
 
 # --- Entry point ---
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        if uvloop is not None:
+            uvloop.run(main())
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         logging.info("🛑 Bot stopped gracefully.")
+    finally:
+        # Flush queued log records before the process exits
+        log_listener.stop()